@@ -7,11 +7,10 @@ sys.path.append(base_path)
 from common.server import A2AServer
 from common.types import AgentCard, AgentCapabilities, AgentSkill, MissingAPIKeyError
 from task_manager import AgentTaskManager
-from agent import Web3Agent
+from agent import Web3Agent, shutdown_mcp
 import click
 import logging
 import asyncio
-import threading
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -34,17 +33,14 @@ def cli(host, port):
         # Run the initialization part in this loop
         server = loop.run_until_complete(setup_server(host, port))
         
-        # Start the server in a separate thread
+        # Serve on the same loop that owns the MCP connection, blocking until interrupted
         logger.info(f"Starting server at http://{host}:{port}")
-        server_thread = threading.Thread(target=server.start)
-        server_thread.daemon = True
-        server_thread.start()
-        
-        # Keep the main thread alive until interrupted
         try:
-            server_thread.join()
+            loop.run_until_complete(server.serve())
         except KeyboardInterrupt:
             logger.info("Server stopped by user")
+        finally:
+            loop.run_until_complete(shutdown_mcp())
             
     except MissingAPIKeyError as e:
         logger.error(f"Error: {e}")
@@ -115,8 +111,6 @@ async def setup_server(host, port):
             port=port,
         )
 
-        # Keep a reference to the event loop
-        setattr(server, "_event_loop", asyncio.get_event_loop())
         logger.info("Server setup complete")
         
         return server
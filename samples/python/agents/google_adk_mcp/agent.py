@@ -1,7 +1,10 @@
+import functools
 import logging
-import threading
-import time
-from typing import Any, AsyncIterable, Dict, Tuple
+import operator
+import os
+import pathlib
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Callable, Dict, Final, Tuple
 from google.adk.agents.llm_agent import LlmAgent
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.memory.in_memory_memory_service import InMemoryMemoryService
@@ -17,169 +20,227 @@ from utils import SchemaFixOptions, create_patched_toolset
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuration constants
-MCP_SERVER_PATH = "/Users/saber/Library/Mobile Documents/com~apple~CloudDocs/Documents/GitHub/mcp-ethers-server/build/src/mcpServer.js"
+# Path to mcpServer.js from mcp-ethers-server, defaulting to a copy next to this file
+MCP_SERVER_PATH = os.environ.get("MCP_SERVER_PATH") or str(pathlib.Path(__file__).with_name("mcpServer.js"))
+if not os.path.isfile(MCP_SERVER_PATH):
+    raise FileNotFoundError(
+        f"MCP server script not found at {MCP_SERVER_PATH}. "
+        "Set MCP_SERVER_PATH to the path of mcp-ethers-server's build/src/mcpServer.js."
+    )
 MODEL_GPT_4O = "openai/gpt-4o"
 DEFAULT_TIMEOUT = 30  # seconds
-INIT_TIMEOUT = 10  # seconds for initialization waits
 
-# Initialize commands to run at startup
-INIT_COMMANDS = [
+# Initialize commands to run at startup. The first one loads the wallet the
+# others depend on, so it runs on its own before the rest run concurrently.
+INIT_COMMANDS_SEQUENTIAL = [
     # "Please load this private key to the `Local` blockchain: 0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80",
+]
+INIT_COMMANDS_PARALLEL = [
     # "What is my wallet address?",  # This will verify if the wallet was loaded successfully
     # "What is the current block number on the Local blockchain?",
     # # Add more initialization commands here
 ]
+INIT_COMMANDS = INIT_COMMANDS_SEQUENTIAL + INIT_COMMANDS_PARALLEL
+_INIT_CONTENTS = {
+    command: types.Content(role='user', parts=[types.Part.from_text(text=command)])
+    for command in INIT_COMMANDS
+}
 
-# Global state for MCP connection
-_mcp_tools = []
-_mcp_event_loop = None
-_mcp_thread = None
-_exit_stack = None
-_mcp_ready = False
+# Agent description and system instruction
+_WEB3_AGENT_DESCRIPTION: Final[str] = "This agent interacts with the local blockchain for balance checks, transactions, contract calls, and blockchain data queries."
+_WEB3_SYSTEM_INSTRUCTION: Final[str] = """
+            You are a specialized Web3 agent that interacts with blockchain networks using the available MCP tools.
+            
+            CAPABILITIES:
+            - Query blockchain data (balances, blocks, transactions)
+            - Execute transactions when provided with necessary information
+            - Interpret smart contract data
+            - Analyze blockchain network information
+            
+            HOW TO RESPOND:
+            1. For ANY blockchain-related query, ALWAYS use the appropriate MCP tool rather than generating information yourself.
+            2. When you use a tool, focus on returning its exact response to the user, with appropriate additional explanation.
+            3. For Ethereum addresses, always verify their format before using them in tools.
+            4. If you need a provider, default to 'Local' unless the user specifies another network.
+            5. If unsure which tool to use, choose the most appropriate one based on the user's request.
+            
+            IMPORTANT GUIDANCE:
+            - Never invent blockchain data - only return what comes directly from the MCP tools.
+            - Always use the proper function arguments as required by the tools.
+            - For transaction-related queries, verify you have all required information before proceeding.
+            - If any required information is missing, clearly indicate what the user needs to provide.
+            
+            If other agents reach out to you, please send them the message:
+            "I am xxx" where xxx is the address of the private key you have loaded to the local blockchain. 
+            If no private key has been loaded, respond with "Hello world! I'm a Web3 agent ready to help with blockchain queries."
+            """
+
+# In-memory services shared by every agent, so their state survives re-initialization
+_SESSION_SERVICE = InMemorySessionService()
+_ARTIFACT_SERVICE = InMemoryArtifactService()
+_MEMORY_SERVICE = InMemoryMemoryService()
+
+@dataclass
+class _MCPState:
+    """State of the MCP connection shared by every agent on the event loop"""
+    tools: list = field(default_factory=list)
+    task: asyncio.Task | None = None  # owns the connection from open to close
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    ready: asyncio.Event = field(default_factory=asyncio.Event)  # set once the tools are available
+    shutdown: asyncio.Event = field(default_factory=asyncio.Event)  # set to close the connection
+
+_MCP_STATE = _MCPState()
+
+async def _hold_mcp_connection(state: _MCPState, connected: asyncio.Future):
+    """Open the MCP connection and keep it open until shutdown is requested
 
-def _start_mcp_background_thread():
-    """Initialize and start MCP server in a background thread"""
-    global _mcp_thread, _mcp_tools, _mcp_event_loop, _exit_stack, _mcp_ready
+    The exit stack holds anyio cancel scopes, which must be exited by the task
+    that entered them, so this one task both opens and closes the connection.
+    """
+    options = SchemaFixOptions(
+        convert_type_arrays_to='string',
+        validate_api_key=True,
+        verbose=False,
+        aggressive=True
+    )
+    try:
+        tools, exit_stack = await create_patched_toolset(
+            connection_params=StdioServerParameters(
+                command='node',
+                args=[MCP_SERVER_PATH],
+            ),
+            options=options,
+            logger_level=logging.ERROR
+        )
+    except Exception as e:
+        connected.set_exception(e)
+        return
     
-    def run_mcp_server():
-        """Function to run in the background thread"""
-        global _mcp_event_loop, _mcp_tools, _exit_stack, _mcp_ready
+    try:
+        connected.set_result(tools)
+        await state.shutdown.wait()
+    finally:
+        await exit_stack.aclose()
+
+async def ensure_mcp_initialized():
+    """Connect to the MCP server on the running event loop, once per process"""
+    state = _MCP_STATE
+    async with state.lock:
+        if state.ready.is_set():
+            return state.tools
         
-        print("Starting MCP server connection in background thread...")
-        _mcp_event_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(_mcp_event_loop)
+        print("Starting MCP server connection...")
+        connected = asyncio.get_running_loop().create_future()
+        state.task = asyncio.create_task(_hold_mcp_connection(state, connected))
         
-        async def initialize_mcp():
-            """Initialize the MCP connection"""
-            global _mcp_tools, _exit_stack, _mcp_ready
-            
-            try:
-                options = SchemaFixOptions(
-                    convert_type_arrays_to='string',
-                    validate_api_key=True,
-                    verbose=False,
-                    aggressive=True
-                )
-                
-                tools, exit_stack = await create_patched_toolset(
-                    connection_params=StdioServerParameters(
-                        command='node',
-                        args=[MCP_SERVER_PATH],
-                    ),
-                    options=options,
-                    logger_level=logging.ERROR
-                )
-                
-                _mcp_tools = tools
-                _exit_stack = exit_stack
-                _mcp_ready = True
-                
-                print(f"Connected to MCP server - {len(tools)} tools available")
-                
-                # Keep the event loop running
-                while True:
-                    await asyncio.sleep(1)
-                    
-            except Exception as e:
-                print(f"Error in MCP connection: {e}")
-                _mcp_ready = False
-            
-        _mcp_event_loop.run_until_complete(initialize_mcp())
+        # asyncio.wait doesn't cancel the future on timeout, so the task can still resolve it
+        done, _ = await asyncio.wait({connected}, timeout=DEFAULT_TIMEOUT)
+        if not done:
+            print("Timed out waiting for MCP server to initialize")
+            state.task.cancel()
+            state.task = None
+        elif connected.exception() is not None:
+            print(f"Error in MCP connection: {connected.exception()}")
+            state.task = None
+        else:
+            state.tools = connected.result()
+            state.ready.set()
+            print(f"Connected to MCP server - {len(state.tools)} tools available")
         
-    # Start the thread and wait for initialization
-    _mcp_thread = threading.Thread(target=run_mcp_server, daemon=True)
-    _mcp_thread.start()
-    
-    # Wait for initialization with timeout
-    start_time = time.time()
-    while not _mcp_ready and time.time() - start_time < DEFAULT_TIMEOUT:
-        time.sleep(0.1)
-    
-    if not _mcp_ready:
-        print("Timed out waiting for MCP server to initialize")
+        return state.tools
 
-# Start the MCP server when module is imported
-_start_mcp_background_thread()
+async def shutdown_mcp():
+    """Close the MCP connection if it was opened"""
+    state = _MCP_STATE
+    async with state.lock:
+        if state.task is None:
+            return
+        # Let the owning task close the connection, then wait for it to finish
+        state.shutdown.set()
+        try:
+            await state.task
+        except Exception as e:
+            print(f"Error closing MCP connection: {e}")
+        finally:
+            state.tools = []
+            state.task = None
+            state.ready.clear()
+            state.shutdown.clear()
+
+# Serializer for each type seen so far, so the attribute probing runs once per type
+_SERIALIZERS: Dict[type, Callable[[Any], Any]] = {}
 
 # Custom JSON serializer to handle special types
 def custom_serializer(obj):
     """Handle non-serializable types for JSON conversion"""
-    if hasattr(obj, '__dict__'):
-        return obj.__dict__
-    elif hasattr(obj, 'to_dict'):
-        return obj.to_dict()
-    else:
-        return str(obj)
+    serializer = _SERIALIZERS.get(type(obj))
+    if serializer is None:
+        if hasattr(obj, '__dict__'):
+            serializer = operator.attrgetter('__dict__')
+        elif hasattr(obj, 'to_dict'):
+            serializer = operator.methodcaller('to_dict')
+        else:
+            serializer = str
+        _SERIALIZERS[type(obj)] = serializer
+    return serializer(obj)
+
+_json_dumps = functools.partial(json.dumps, default=custom_serializer, separators=(',', ':'))
+
+# Prefer orjson for serializing tool responses when it is installed
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> str:
+        try:
+            return orjson.dumps(obj, default=custom_serializer, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # orjson rejects integers wider than 64 bits, e.g. wei amounts; json handles them
+            return _json_dumps(obj)
+except ImportError:
+    _dumps = _json_dumps
 
 class Web3Agent:
     """Web3 Agent for blockchain interactions"""
 
     SUPPORTED_CONTENT_TYPES = ["text", "text/plain"]
 
+    __slots__ = ('_agent', '_user_id', '_runner', '_tools', '_init_completed', '_sessions')
+
     def __init__(self):
         self._agent = None
         self._user_id = "remote_agent"
         self._runner = None
         self._tools = []
         self._init_completed = False
+        self._sessions = {}  # session_id -> session, filled lazily by invoke
         
     async def initialize(self):
         """Initialize the agent using the shared MCP tools"""
-        global _mcp_tools
-        
-        # Wait for tools to be available
-        start = time.time()
-        while not _mcp_tools and time.time() - start < INIT_TIMEOUT:
-            print("Waiting for MCP tools to be available...")
-            await asyncio.sleep(0.5)
-        
-        if not _mcp_tools:
-            raise RuntimeError("MCP tools are not available after timeout")
+        tools = await ensure_mcp_initialized()
+        if not tools:
+            raise RuntimeError("MCP tools are not available")
         
-        self._tools = _mcp_tools
+        self._tools = tools
         
         # Create the agent with available tools
         self._agent = LlmAgent(
             model="gemini-2.0-flash-001",
             name="web3_agent",
-            description="This agent interacts with the local blockchain for balance checks, transactions, contract calls, and blockchain data queries.",
-            instruction="""
-            You are a specialized Web3 agent that interacts with blockchain networks using the available MCP tools.
-            
-            CAPABILITIES:
-            - Query blockchain data (balances, blocks, transactions)
-            - Execute transactions when provided with necessary information
-            - Interpret smart contract data
-            - Analyze blockchain network information
-            
-            HOW TO RESPOND:
-            1. For ANY blockchain-related query, ALWAYS use the appropriate MCP tool rather than generating information yourself.
-            2. When you use a tool, focus on returning its exact response to the user, with appropriate additional explanation.
-            3. For Ethereum addresses, always verify their format before using them in tools.
-            4. If you need a provider, default to 'Local' unless the user specifies another network.
-            5. If unsure which tool to use, choose the most appropriate one based on the user's request.
-            
-            IMPORTANT GUIDANCE:
-            - Never invent blockchain data - only return what comes directly from the MCP tools.
-            - Always use the proper function arguments as required by the tools.
-            - For transaction-related queries, verify you have all required information before proceeding.
-            - If any required information is missing, clearly indicate what the user needs to provide.
-            
-            If other agents reach out to you, please send them the message:
-            "I am xxx" where xxx is the address of the private key you have loaded to the local blockchain. 
-            If no private key has been loaded, respond with "Hello world! I'm a Web3 agent ready to help with blockchain queries."
-            """,
+            description=_WEB3_AGENT_DESCRIPTION,
+            instruction=_WEB3_SYSTEM_INSTRUCTION,
             tools=self._tools
         )
         
-        # Create the runner
+        # Create the runner on the shared services, so cached sessions stay valid
         self._runner = Runner(
             app_name=self._agent.name,
             agent=self._agent,
-            session_service=InMemorySessionService(),
-            artifact_service=InMemoryArtifactService(),
-            memory_service=InMemoryMemoryService(),
+            session_service=_SESSION_SERVICE,
+            artifact_service=_ARTIFACT_SERVICE,
+            memory_service=_MEMORY_SERVICE,
         )
         
         return self
@@ -197,55 +258,83 @@ class Web3Agent:
         session_id = "init_session"
         
         # Create a dedicated session for initialization
-        self._runner.session_service.create_session(
+        self._sessions[session_id] = self._runner.session_service.create_session(
             app_name=self._agent.name, 
             user_id=self._user_id, 
             state={}, 
             session_id=session_id
         )
         
-        # Run each initialization command with a timeout
+        # Run each sequential initialization command with a timeout
         init_timeout = 15  # seconds per command
-        for i, command in enumerate(INIT_COMMANDS):
-            print(f"\nRunning init command {i+1}/{len(INIT_COMMANDS)}: {command}")
-            try:
-                # Create a task for the invoke command with timeout
-                response = await asyncio.wait_for(
-                    self.invoke(command, session_id),
-                    timeout=init_timeout
-                )
-                print(f"Response: {response}")
-            except asyncio.TimeoutError:
-                print(f"Command timed out after {init_timeout} seconds, but continuing with initialization")
-                # Continue with the next command despite timeout
-                continue
-            except Exception as e:
-                print(f"Error running initialization command: {e}")
-                # Continue with the next command despite error
-                continue
+        for i, command in enumerate(INIT_COMMANDS_SEQUENTIAL, start=1):
+            print(f"\nRunning init command {i}/{len(INIT_COMMANDS)}: {command}")
+            result = await self._safe_invoke(command, session_id, init_timeout)
+            self._print_init_result(i, result, init_timeout)
+        
+        # Run the independent commands concurrently, each in its own session so
+        # their conversations don't interleave
+        offset = len(INIT_COMMANDS_SEQUENTIAL)
+        for i, command in enumerate(INIT_COMMANDS_PARALLEL, start=offset + 1):
+            print(f"\nRunning init command {i}/{len(INIT_COMMANDS)}: {command}")
+        results = await asyncio.gather(
+            *(
+                self._safe_invoke(command, f"{session_id}_{i}", init_timeout)
+                for i, command in enumerate(INIT_COMMANDS_PARALLEL, start=offset + 1)
+            )
+        )
+        for i, result in enumerate(results, start=offset + 1):
+            self._print_init_result(i, result, init_timeout)
                 
         self._init_completed = True
         print("\n==== INITIALIZATION COMPLETED ====")
 
+    async def _safe_invoke(self, command, session_id, timeout):
+        """Run one initialization command, returning its response or the exception it raised"""
+        try:
+            return await asyncio.wait_for(
+                self._invoke_content(_INIT_CONTENTS[command], session_id),
+                timeout=timeout
+            )
+        except Exception as e:
+            return e
+
+    @staticmethod
+    def _print_init_result(index, result, timeout):
+        """Report the outcome of an initialization command; failures don't stop initialization"""
+        if isinstance(result, asyncio.TimeoutError):
+            print(f"Init command {index} timed out after {timeout} seconds, but continuing with initialization")
+        elif isinstance(result, Exception):
+            print(f"Error running initialization command {index}: {result}")
+        else:
+            print(f"Response to init command {index}: {result}")
+
     async def invoke(self, query, session_id) -> str:
         """Process a user query and return a response"""
+        content = types.Content(role='user', parts=[types.Part.from_text(text=query)])
+        return await self._invoke_content(content, session_id)
+
+    async def _invoke_content(self, content, session_id) -> str:
+        """Send prebuilt user content to the model and return a response"""
         if not self._agent or not self._runner:
             raise RuntimeError("Agent not initialized. Call initialize() first.")
                 
-        # Get or create the session
-        session = self._runner.session_service.get_session(
-            app_name=self._agent.name, user_id=self._user_id, session_id=session_id
-        )
+        # Get or create the session, looking it up in the service only once per session ID
+        session = self._sessions.get(session_id)
         if session is None:
-            session = self._runner.session_service.create_session(
-                app_name=self._agent.name, user_id=self._user_id, state={}, session_id=session_id
+            session = self._runner.session_service.get_session(
+                app_name=self._agent.name, user_id=self._user_id, session_id=session_id
             )
+            if session is None:
+                session = self._runner.session_service.create_session(
+                    app_name=self._agent.name, user_id=self._user_id, state={}, session_id=session_id
+                )
+            self._sessions[session_id] = session
         
-        content = types.Content(role='user', parts=[types.Part.from_text(text=query)])
-        
-        print(f"\n==== SENDING QUERY TO MODEL ====")
-        print(f"Query: {query}")
-        print(f"Session ID: {session.id}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("==== SENDING QUERY TO MODEL ====")
+            logger.debug("Query: %s", content.parts[0].text)
+            logger.debug("Session ID: %s", session.id)
         
         # Get events from the runner asynchronously
         events_async = self._runner.run_async(
@@ -260,38 +349,40 @@ class Web3Agent:
             
             async for event in events_async:
                 # Process function responses and text
-                if hasattr(event, 'content') and event.content and event.content.parts:                    
-                    for part in event.content.parts:
+                event_content = getattr(event, 'content', None)
+                if event_content and event_content.parts:
+                    for part in event_content.parts:
+                        function_response = getattr(part, 'function_response', None)
+                        text = getattr(part, 'text', None)
+                        function_call = getattr(part, 'function_call', None)
+                        
                         # Handle function response
-                        if hasattr(part, 'function_response') and part.function_response:
-                            print(f"\n==== TOOL RESPONSE ====")
-                            print(f"Response: {part.function_response.response}")
-                            final_response = part.function_response.response
+                        if function_response:
+                            if logger.isEnabledFor(logging.DEBUG):
+                                logger.debug("==== TOOL RESPONSE ====")
+                                logger.debug("Response: %s", function_response.response)
+                            final_response = function_response.response
                             
-                            # Special handling for various response types
+                            if isinstance(final_response, str):
+                                return final_response
+                            # custom_serializer covers CallToolResult and other complex types
                             try:
-                                # Convert dict/list to JSON string using custom serializer
-                                if isinstance(final_response, (dict, list)):
-                                    return json.dumps(final_response, default=custom_serializer)
-                                # Handle CallToolResult and other complex types
-                                elif hasattr(final_response, '__dict__') or hasattr(final_response, 'to_dict'):
-                                    return json.dumps(final_response, default=custom_serializer)
-                                # Default handling for simple types
-                                return str(final_response)
-                            except Exception as e:
+                                return _dumps(final_response)
+                            except (TypeError, ValueError) as e:
                                 # Fallback for any serialization errors
-                                print(f"Serialization error: {e}")
-                                return f"Response: {str(final_response)}"
+                                logger.warning("Serialization error: %s", e)
+                                return str(final_response)
                             
                         # Track text responses
-                        elif hasattr(part, 'text') and part.text:
-                            last_text_response = part.text
+                        elif text:
+                            last_text_response = text
                             
                         # Debug tool calls
-                        elif hasattr(part, 'function_call') and part.function_call:
-                            print(f"\n==== TOOL CALL ====")
-                            print(f"Tool: {part.function_call.name}")
-                            print(f"Arguments: {part.function_call.args}")
+                        elif function_call:
+                            if logger.isEnabledFor(logging.DEBUG):
+                                logger.debug("==== TOOL CALL ====")
+                                logger.debug("Tool: %s", function_call.name)
+                                logger.debug("Arguments: %s", function_call.args)
             
             # Return the last text response if no function response
             if last_text_response:
@@ -302,8 +393,11 @@ class Web3Agent:
         except asyncio.TimeoutError:
             return "Query timed out"
         except Exception as e:
-            print(f"Error processing response: {e}")
+            logger.error("Error processing response: %s", e)
             return f"Error: {str(e)}"
+        finally:
+            # Release the runner's stream now rather than when the generator is collected
+            await events_async.aclose()
     
     async def stream(self, query, session_id) -> AsyncIterable[Dict[str, Any]]:
         """Streaming is not supported by Web3 Agent."""
@@ -9,6 +9,7 @@ as lists (e.g., ['string', 'number']) which are not compatible with Google ADK.
 import logging
 import os
 import inspect
+from collections import deque
 from typing import List, Dict, Any, Optional, Tuple, Union
 from google.adk.tools.mcp_tool.mcp_tool import MCPTool
 from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset
@@ -19,6 +20,8 @@ logger = logging.getLogger(__name__)
 class SchemaFixOptions:
     """Options for schema fixing."""
     
+    __slots__ = ('convert_type_arrays_to', 'validate_api_key', 'verbose', 'aggressive')
+    
     def __init__(
         self,
         convert_type_arrays_to: str = 'string',
@@ -41,52 +44,16 @@ class SchemaFixOptions:
         self.aggressive = aggressive
 
 
-def fix_openai_validation_errors(obj, options=None, path=''):
-    """
-    Fix specific validation errors that OpenAI commonly reports.
-    
-    Args:
-        obj: The object to fix
-        options: SchemaFixOptions
-        path: Current path for debugging
-    """
-    if not isinstance(obj, dict):
-        return
-        
-    # Fix for: "In context=('properties', 'args'), array schema missing items"
-    if 'type' in obj and obj['type'] == 'array' and 'items' not in obj:
-        obj['items'] = {'type': 'string'}
-        logger.warning(f"Fixed array schema missing items at {path}")
-        
-    # Check properties dictionary
-    if 'properties' in obj and isinstance(obj['properties'], dict):
-        props = obj['properties']
-        
-        # Fix args property specifically (common in contractCall error)
-        if 'args' in props and isinstance(props['args'], dict):
-            args_prop = props['args']
-            if args_prop.get('type') == 'array' and 'items' not in args_prop:
-                args_prop['items'] = {'type': 'string'}
-                logger.warning(f"Fixed args array missing items at {path}.properties.args")
-        
-        # Process each property
-        for prop_name, prop_schema in props.items():
-            if isinstance(prop_schema, dict):
-                fix_openai_validation_errors(prop_schema, options, f"{path}.properties.{prop_name}")
-
-    # Process nested objects
-    for key, value in obj.items():
-        if isinstance(value, dict):
-            fix_openai_validation_errors(value, options, f"{path}.{key}")
-        elif isinstance(value, list):
-            for i, item in enumerate(value):
-                if isinstance(item, dict):
-                    fix_openai_validation_errors(item, options, f"{path}.{key}[{i}]")
+# Shared options used whenever a caller doesn't pass any
+_DEFAULT_OPTIONS = SchemaFixOptions()
 
 
 def fix_schema_types_recursive(obj: Any, options: SchemaFixOptions = None, path: str = '') -> None:
     """
-    Recursively fix type arrays in schema dictionaries.
+    Fix type arrays and array schemas missing 'items' in nested schema dictionaries.
+    
+    Every node is fixed in a single pass. The schema is walked with an explicit stack rather than recursion, so deeply
+    nested MCP schemas cannot hit the recursion limit.
     
     Args:
         obj: The object to fix (dict or list)
@@ -94,93 +61,101 @@ def fix_schema_types_recursive(obj: Any, options: SchemaFixOptions = None, path:
         path: Current path in the schema (for debugging)
     """
     if options is None:
-        options = SchemaFixOptions()
+        options = _DEFAULT_OPTIONS
+    
+    # Paths are only read by log messages, so don't build them when quiet
+    verbose = options.verbose
+    stack = deque([(obj, path if verbose else '')])
+    while stack:
+        cur, cur_path = stack.pop()
         
-    if isinstance(obj, dict):
-        # First fix OpenAI validation errors
-        fix_openai_validation_errors(obj, options, path)
+        if isinstance(cur, dict):
+            # If the 'type' field is a list, convert it to the specified type
+            if 'type' in cur and isinstance(cur['type'], list):
+                if verbose and logger.level <= logging.DEBUG:
+                    logger.debug("Converting type array at %s: %s to '%s'", cur_path, cur['type'], options.convert_type_arrays_to)
+                cur['type'] = options.convert_type_arrays_to
+                
+            # Special handling for enums that should be strings
+            if options.aggressive and 'enum' in cur and isinstance(cur.get('enum'), list):
+                # Make sure all enum values are strings
+                cur['enum'] = [str(val) if not isinstance(val, str) else val for val in cur['enum']]
+                
+            # Fix for array type schemas that are missing 'items', which OpenAI
+            # rejects (e.g. "In context=('properties', 'args'), array schema missing items")
+            if cur.get('type') == 'array' and 'items' not in cur:
+                # Add a default items schema for arrays
+                cur['items'] = {'type': 'string'}
+                logger.warning("Fixed array schema missing items at %s", cur_path)
+                
+            # Queue all nested dictionaries and lists
+            for k, v in cur.items():
+                if isinstance(v, (dict, list)):
+                    if verbose:
+                        stack.append((v, f"{cur_path}.{k}" if cur_path else k))
+                    else:
+                        stack.append((v, ''))
         
-        # If the 'type' field is a list, convert it to the specified type
-        if 'type' in obj and isinstance(obj['type'], list):
-            if options.verbose and logger.level <= logging.DEBUG:
-                logger.debug(f"Converting type array at {path}: {obj['type']} to '{options.convert_type_arrays_to}'")
-            obj['type'] = options.convert_type_arrays_to
-            
-        # Special handling for enums that should be strings
-        if options.aggressive and 'enum' in obj and isinstance(obj.get('enum'), list):
-            # Make sure all enum values are strings
-            obj['enum'] = [str(val) if not isinstance(val, str) else val for val in obj['enum']]
-            
-        # Fix for array type schemas that are missing 'items'
-        if options.aggressive and obj.get('type') == 'array' and 'items' not in obj:
-            # Add a default items schema for arrays
-            obj['items'] = {'type': 'string'}
-            if logger.level <= logging.INFO:
-                logger.info(f"Fixed array schema missing items at {path}")
-            
-        # Process all nested dictionaries and lists
-        for k, v in obj.items():
-            if isinstance(v, (dict, list)):
-                new_path = f"{path}.{k}" if path else k
-                fix_schema_types_recursive(v, options, new_path)
-    
-    elif isinstance(obj, list):
-        # Process all items in the list
-        for i, item in enumerate(obj):
-            if isinstance(item, (dict, list)):
-                new_path = f"{path}[{i}]"
-                fix_schema_types_recursive(item, options, new_path)
+        elif isinstance(cur, list):
+            # Queue all items in the list
+            for i, item in enumerate(cur):
+                if isinstance(item, (dict, list)):
+                    stack.append((item, f"{cur_path}[{i}]" if verbose else ''))
 
 
-def patch_object_attributes(obj, name, options, visited=None):
+def _schema_needs_fix(schema: Any, options: SchemaFixOptions) -> bool:
     """
-    Recursively patch attributes of an object to fix schema types.
+    Check whether fix_schema_types_recursive would change a schema.
     
     Args:
-        obj: The object to patch
-        name: The name of the object (for debugging)
+        schema: The schema to check (dict or list)
         options: Schema fix options
-        visited: Set of visited objects to avoid circular references
+    
+    Returns:
+        True if any node has a type array, an array schema missing 'items',
+        or (when aggressive) a non-string enum value
     """
-    if visited is None:
-        visited = set()
-        
-    # Check if we've already visited this object
-    obj_id = id(obj)
-    if obj_id in visited:
-        return
+    stack = [schema]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, dict):
+            schema_type = cur.get('type')
+            if isinstance(schema_type, list):
+                return True
+            if schema_type == 'array' and 'items' not in cur:
+                return True
+            enum = cur.get('enum')
+            if options.aggressive and isinstance(enum, list) and not all(isinstance(val, str) for val in enum):
+                return True
+            stack.extend(v for v in cur.values() if isinstance(v, (dict, list)))
+        elif isinstance(cur, list):
+            stack.extend(item for item in cur if isinstance(item, (dict, list)))
+    return False
+
+
+def _walk_declaration(declaration, options: SchemaFixOptions, name: str = '') -> None:
+    """
+    Fix the schema dictionaries of a function declaration.
     
-    # Add to visited set
-    visited.add(obj_id)
+    Only the known schema locations are inspected, instead of reflecting over
+    every attribute of the declaration object.
     
-    # Look through attributes
-    for attr_name in dir(obj):
-        # Skip private attributes and methods
-        if attr_name.startswith('_') or callable(getattr(obj, attr_name, None)):
-            continue
-            
-        try:
-            attr = getattr(obj, attr_name)
-            
-            # Fix any dictionary schemas
-            if isinstance(attr, dict):
-                if options.verbose:
-                    logger.debug(f"Checking dictionary attribute: {name}.{attr_name}")
-                fix_schema_types_recursive(attr, options, f"{name}.{attr_name}")
-                
-            # Fix any list schemas
-            elif isinstance(attr, list):
-                if options.verbose:
-                    logger.debug(f"Checking list attribute: {name}.{attr_name}")
-                fix_schema_types_recursive(attr, options, f"{name}.{attr_name}")
-                
-            # Recursively patch nested objects
-            elif attr is not None and not isinstance(attr, (str, int, float, bool)):
-                patch_object_attributes(attr, f"{name}.{attr_name}", options, visited)
-                
-        except Exception as e:
-            if options.verbose:
-                logger.debug(f"Error accessing/fixing attribute {name}.{attr_name}: {e}")
+    Args:
+        declaration: The function declaration to fix
+        options: Schema fix options
+        name: The name of the declaration (for debugging)
+    """
+    parameters = getattr(declaration, 'parameters', None)
+    if not parameters:
+        return
+    
+    for attr_name in ('schema_', 'properties'):
+        schema = getattr(parameters, attr_name, None)
+        if isinstance(schema, dict):
+            path = f"{name}.parameters.{attr_name}" if options.verbose else ''
+            if options.verbose and logger.level <= logging.DEBUG:
+                logger.debug("Fixing schema: %s", path)
+            fix_schema_types_recursive(schema, options, path)
 
 
 def patch_mcp_tool(tool: MCPTool, options: SchemaFixOptions = None) -> MCPTool:
@@ -195,7 +170,7 @@ def patch_mcp_tool(tool: MCPTool, options: SchemaFixOptions = None) -> MCPTool:
         The patched MCP tool
     """
     if options is None:
-        options = SchemaFixOptions()
+        options = _DEFAULT_OPTIONS
     
     # Special handling for contractCall function which has a known issue
     if tool.name == "contractCall":
@@ -212,14 +187,21 @@ def patch_mcp_tool(tool: MCPTool, options: SchemaFixOptions = None) -> MCPTool:
                     args_prop["items"] = {"type": "string"}
                     logger.info("Fixed contractCall args array schema")
     
-    # Save the original method
-    original_get_declaration = tool._get_declaration
+    # The declaration is built from the MCP input schema, so check that
+    # dict rather than the genai Schema objects derived from it
+    input_schema = getattr(getattr(tool, 'mcp_tool', None), 'inputSchema', None)
+    needs_fix = not isinstance(input_schema, dict) or _schema_needs_fix(input_schema, options)
     
-    # Define a patched method
-    def patched_get_declaration(self=tool):
-        # Call the original method
-        declaration = original_get_declaration()
-        
+    # Fix the MCP input schema before the declaration is built from it if aggressive is enabled
+    if needs_fix and options.aggressive and isinstance(input_schema, dict):
+        path = f"tool.{tool.name}.mcp_tool.inputSchema" if options.verbose else ''
+        if options.verbose and logger.level <= logging.DEBUG:
+            logger.debug("Aggressive patching for tool object: %s", tool.name)
+        fix_schema_types_recursive(input_schema, options, path)
+    
+    declaration = tool._get_declaration()
+    
+    if needs_fix:
         # Special handling for contractCall function
         if tool.name == "contractCall":
             # Try to find and fix the args property
@@ -233,32 +215,14 @@ def patch_mcp_tool(tool: MCPTool, options: SchemaFixOptions = None) -> MCPTool:
                                 args_prop["items"] = {"type": "string"}
                                 logger.info("Fixed contractCall args array schema in declaration")
         
-        # Access the schema_dict directly if it exists
-        if hasattr(declaration, 'parameters') and declaration.parameters:
-            if hasattr(declaration.parameters, 'schema_'):
-                schema_dict = declaration.parameters.schema_
-                if options.verbose and logger.level <= logging.DEBUG:
-                    logger.debug(f"Fixing schema for tool: {tool.name}")
-                
-                # Apply the schema fix
-                fix_schema_types_recursive(schema_dict, options, f"tool.{tool.name}.parameters.schema_")
-                
-        # If aggressive option is enabled, patch all attributes of the declaration
-        if options.aggressive:
-            if options.verbose and logger.level <= logging.DEBUG:
-                logger.debug(f"Aggressive patching for tool: {tool.name}")
-            patch_object_attributes(declaration, f"tool.{tool.name}.declaration", options)
-        
-        return declaration
-    
-    # Replace the method with our patched version
-    tool._get_declaration = patched_get_declaration
+        # Fix the declaration's schema dictionaries
+        _walk_declaration(declaration, options, f"tool.{tool.name}" if options.verbose else '')
+    elif options.verbose and logger.level <= logging.DEBUG:
+        logger.debug("Schema for tool %s needs no fixing", tool.name)
     
-    # Also patch the tool itself if aggressive is enabled
-    if options.aggressive:
-        if options.verbose and logger.level <= logging.DEBUG:
-            logger.debug(f"Aggressive patching for tool object: {tool.name}")
-        patch_object_attributes(tool, f"tool.{tool.name}", options)
+    # Declarations don't change after startup, so hand back the fixed
+    # object on every later call instead of rebuilding it
+    tool._get_declaration = lambda declaration=declaration: declaration
     
     return tool
 
@@ -284,6 +248,24 @@ def validate_api_key() -> bool:
     return True
 
 
+def _fix_contract_call(tool) -> None:
+    """Fix the args array schema of the contractCall tool wherever it is exposed.
+    
+    Args:
+        tool: The contractCall tool to fix
+    """
+    logger.info(f"Checking contractCall tool schema")
+    
+    # Fix schema directly, then try alternative schema locations
+    for attr in ['schema', '_schema', 'function_schema', '_function_schema']:
+        schema = getattr(tool, attr, None)
+        if isinstance(schema, dict) and 'properties' in schema and 'args' in schema['properties']:
+            args_prop = schema['properties']['args']
+            if args_prop.get('type') == 'array' and 'items' not in args_prop:
+                args_prop['items'] = {'type': 'string'}
+                logger.info(f"Fixed contractCall {attr} args array")
+
+
 def fix_tool_schema_objects(tools):
     """Fix schemas at the object/class level where they might not be exposed.
     
@@ -296,31 +278,12 @@ def fix_tool_schema_objects(tools):
     Returns:
         Fixed tools list
     """
-    for tool in tools:
-        if hasattr(tool, 'name'):
-            # Fix contractCall specifically
-            if tool.name == "contractCall":
-                logger.info(f"Checking contractCall tool schema")
-                
-                # Fix schema directly
-                if hasattr(tool, 'schema') and isinstance(tool.schema, dict):
-                    schema = tool.schema
-                    # Fix args property
-                    if 'properties' in schema and 'args' in schema['properties']:
-                        args_prop = schema['properties']['args']
-                        if args_prop.get('type') == 'array' and 'items' not in args_prop:
-                            args_prop['items'] = {'type': 'string'}
-                            logger.info("Fixed contractCall schema args array")
-                
-                # Try alternative schema locations
-                for attr in ['_schema', 'function_schema', '_function_schema']:
-                    if hasattr(tool, attr) and isinstance(getattr(tool, attr), dict):
-                        schema = getattr(tool, attr)
-                        if 'properties' in schema and 'args' in schema['properties']:
-                            args_prop = schema['properties']['args']
-                            if args_prop.get('type') == 'array' and 'items' not in args_prop:
-                                args_prop['items'] = {'type': 'string'}
-                                logger.info(f"Fixed contractCall {attr} args array")
+    tools_by_name = {getattr(tool, 'name', None): tool for tool in tools}
+    
+    # Fix contractCall specifically
+    contract_call = tools_by_name.get("contractCall")
+    if contract_call is not None:
+        _fix_contract_call(contract_call)
     
     return tools
 
@@ -350,7 +313,7 @@ async def create_patched_toolset(
     logger.setLevel(logger_level)
     
     if options is None:
-        options = SchemaFixOptions()
+        options = _DEFAULT_OPTIONS
     
     # Validate API key silently unless verbose is enabled
     if options.validate_api_key and (logger_level <= logging.INFO or options.verbose):
@@ -369,7 +332,8 @@ async def create_patched_toolset(
             if isinstance(tool, MCPTool):
                 if options.verbose and logger_level <= logging.DEBUG:
                     logger.debug(f"Patching tool: {tool.name}")
-                fixed_tools.append(patch_mcp_tool(tool, options))
+                tool = patch_mcp_tool(tool, options)
+                fixed_tools.append(tool)
             else:
                 fixed_tools.append(tool)
         
@@ -1,5 +1,5 @@
 import json
-import traceback
+import sys
 import asyncio
 from typing import AsyncIterable, Union, Any
 from common.types import (
@@ -10,7 +10,6 @@ from common.types import (
     Artifact,
     TaskStatusUpdateEvent,
     TaskArtifactUpdateEvent,
-    TextPart,
     TaskState,
     Task,
     SendTaskResponse,
@@ -26,9 +25,43 @@ import logging
 
 # Constants
 BLOCKCHAIN_TIMEOUT = 45  # seconds for blockchain operations which can be slow
+OFFLOAD_THRESHOLD = 4096  # bytes above which JSON conversion runs in a worker thread
+_SUPPORTED_CONTENT_TYPES = frozenset(Web3Agent.SUPPORTED_CONTENT_TYPES)
 
 logger = logging.getLogger(__name__)
 
+
+def _normalize(value: Any) -> Any:
+    """Convert a value to JSON-compatible types, using custom_serializer for other objects"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {_normalize_key(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return _normalize(custom_serializer(value))
+
+
+def _normalize_key(key: Any) -> str:
+    """Convert a dictionary key to a string the same way json.dumps does"""
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (int, float, bool)):
+        return json.dumps(key)
+    raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+
+
+def _parse_json_result(result: Any) -> Any:
+    """Parse a JSON string result or normalize a structured one"""
+    if isinstance(result, str):
+        try:
+            return json.loads(result)
+        except json.JSONDecodeError:
+            # If direct parsing fails, it might be a complex object stringified
+            logger.debug("TaskManager: Initial JSON parse failed, trying custom conversion...")
+    return _normalize(result)
+
+
 class AgentTaskManager(InMemoryTaskManager):
     """Task manager for the Web3 Agent that handles blockchain requests"""
 
@@ -44,23 +77,17 @@ class AgentTaskManager(InMemoryTaskManager):
         await agent.initialize()
         return instance
 
-    async def _stream_generator(
-      self, request: SendTaskRequest
-    ) -> AsyncIterable[SendTaskResponse]:
-        """Streaming support is not implemented"""
-        raise NotImplementedError("Streaming is not implemented")
-    
     def _validate_request(
         self, request: Union[SendTaskRequest, SendTaskStreamingRequest]
     ) -> None:
         """Validate that the request content type is supported"""
         task_send_params: TaskSendParams = request.params
-        if not utils.are_modalities_compatible(
-            task_send_params.acceptedOutputModes, Web3Agent.SUPPORTED_CONTENT_TYPES
-        ):
+        accepted_output_modes = task_send_params.acceptedOutputModes
+        # An empty accepted list means the client takes any output mode
+        if accepted_output_modes and _SUPPORTED_CONTENT_TYPES.isdisjoint(accepted_output_modes):
             logger.warning(
                 "Unsupported output mode. Received %s, Support %s",
-                task_send_params.acceptedOutputModes,
+                accepted_output_modes,
                 Web3Agent.SUPPORTED_CONTENT_TYPES,
             )
             return utils.new_incompatible_types_error(request.id)
@@ -77,31 +104,29 @@ class AgentTaskManager(InMemoryTaskManager):
         self, request: SendTaskStreamingRequest
     ) -> AsyncIterable[SendTaskStreamingResponse] | JSONRPCResponse:
         """Handle a streaming task request (not implemented)"""
-        error = self._validate_request(request)
-        if error:
-            return error
-        await self.upsert_task(request.params)
-        return self._stream_generator(request)
+        # Streaming is unsupported, so reject before validating or storing the task
+        return utils.new_not_implemented_error(request.id)
     
     async def _update_store(
         self, task_id: str, status: TaskStatus, artifacts: list[Artifact]
     ) -> Task:
         """Update the task store with new status and artifacts"""
-        async with self.lock:
-            try:
-                task = self.tasks[task_id]
-            except KeyError:
-                logger.error(f"Task {task_id} not found for updating the task")
-                raise ValueError(f"Task {task_id} not found")
-                
-            task.status = status
+        # Nothing below awaits, so the update can't interleave with another
+        # coroutine on the event loop and needs no lock
+        try:
+            task = self.tasks[task_id]
+        except KeyError:
+            logger.error(f"Task {task_id} not found for updating the task")
+            raise ValueError(f"Task {task_id} not found")
             
-            if artifacts is not None:
-                if task.artifacts is None:
-                    task.artifacts = []
-                task.artifacts.extend(artifacts)
-                
-            return task
+        task.status = status
+        
+        if artifacts is not None:
+            if task.artifacts is None:
+                task.artifacts = []
+            task.artifacts.extend(artifacts)
+            
+        return task
         
     async def _invoke(self, request: SendTaskRequest) -> SendTaskResponse:
         """Process a task by invoking the agent"""
@@ -109,16 +134,14 @@ class AgentTaskManager(InMemoryTaskManager):
         query = self._get_user_query(task_send_params)
         
         try:
-            print(f"TaskManager: Invoking agent with query: {query}")
+            logger.debug("TaskManager: Invoking agent with query: %s", query)
             
             try:
                 # Wait for agent response with timeout
-                result = await asyncio.wait_for(
-                    self.agent.invoke(query, task_send_params.sessionId),
-                    timeout=BLOCKCHAIN_TIMEOUT
-                )
+                async with asyncio.timeout(BLOCKCHAIN_TIMEOUT):
+                    result = await self.agent.invoke(query, task_send_params.sessionId)
                 
-                print(f"TaskManager: Agent response received: {result}")
+                logger.debug("TaskManager: Agent response received: %s", result)
                 
                 # Ensure we have a result
                 if result is None:
@@ -127,27 +150,24 @@ class AgentTaskManager(InMemoryTaskManager):
                 # Determine if result is JSON or text
                 try:
                     # Try to parse as JSON with custom serializer if needed
-                    if isinstance(result, (dict, list)) or result.startswith("{") or result.startswith("["):
-                        # Try to parse the result directly or convert with custom serializer
-                        if isinstance(result, str):
-                            try:
-                                json_result = json.loads(result)
-                            except json.JSONDecodeError:
-                                # If direct parsing fails, it might be a complex object stringified
-                                print("Initial JSON parse failed, trying custom conversion...")
-                                json_result = json.loads(json.dumps(result, default=custom_serializer))
+                    is_str = isinstance(result, str)
+                    if isinstance(result, (dict, list)) or (is_str and result[:1] in ("{", "[")):
+                        # Try to parse the result directly or convert with custom serializer.
+                        # Large payloads are converted off the event loop so other tasks keep running.
+                        payload_size = len(result) if is_str else sys.getsizeof(result)
+                        if payload_size > OFFLOAD_THRESHOLD:
+                            json_result = await asyncio.to_thread(_parse_json_result, result)
                         else:
-                            # Handle non-string objects
-                            json_result = json.loads(json.dumps(result, default=custom_serializer))
+                            json_result = _parse_json_result(result)
                             
-                        print(f"TaskManager: Detected JSON response: {json_result}")
+                        logger.debug("TaskManager: Detected JSON response: %s", json_result)
                         parts = [{"type": "data", "data": json_result}]
                     else:
-                        print(f"TaskManager: Detected text response: {result}")
+                        logger.debug("TaskManager: Detected text response: %s", result)
                         parts = [{"type": "text", "text": result}]
                 except (json.JSONDecodeError, TypeError) as e:
                     # If all JSON parsing attempts fail, treat as text
-                    print(f"TaskManager: JSON parsing failed ({e}), treating as text: {result}")
+                    logger.debug("TaskManager: JSON parsing failed (%s), treating as text: %s", e, result)
                     parts = [{"type": "text", "text": str(result)}]
                 
                 # Determine task state based on content
@@ -170,19 +190,17 @@ class AgentTaskManager(InMemoryTaskManager):
                 return SendTaskResponse(id=request.id, result=task)
                 
             except asyncio.TimeoutError:
-                print(f"TaskManager: Timeout waiting for agent response after {BLOCKCHAIN_TIMEOUT} seconds")
-                return self._create_error_response(
+                logger.warning("TaskManager: Timeout waiting for agent response after %s seconds", BLOCKCHAIN_TIMEOUT)
+                return await self._create_error_response(
                     request.id,
                     task_send_params.id,
                     f"Timeout waiting for response from blockchain after {BLOCKCHAIN_TIMEOUT} seconds"
                 )
                 
         except Exception as e:
-            print(f"TaskManager: Error invoking agent: {e}")
-            logger.error(f"Error invoking agent: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error invoking agent: %s", e)
             
-            return self._create_error_response(
+            return await self._create_error_response(
                 request.id, 
                 task_send_params.id,
                 f"Error invoking agent: {str(e)}"
@@ -197,28 +215,24 @@ class AgentTaskManager(InMemoryTaskManager):
                 pass
         return value
 
-    def _create_error_response(self, request_id: str, task_id: str, error_msg: str) -> SendTaskResponse:
+    async def _create_error_response(self, request_id: str, task_id: str, error_msg: str) -> SendTaskResponse:
         """Create a standardized error response"""
         parts = [{"type": "text", "text": error_msg}]
         
-        try:
-            # Try to update the task with the error
-            task = asyncio.run(self._update_store(
-                task_id,
-                TaskStatus(
-                    state=TaskState.COMPLETED, 
-                    message=Message(role="agent", parts=parts)
-                ),
-                [Artifact(parts=parts)],
-            ))
-            return SendTaskResponse(id=request_id, result=task)
-        except Exception:
-            # If we can't update the task, raise the original error
-            raise ValueError(error_msg)
+        # Update the task with the error on the running event loop
+        task = await self._update_store(
+            task_id,
+            TaskStatus(
+                state=TaskState.COMPLETED, 
+                message=Message(role="agent", parts=parts)
+            ),
+            [Artifact(parts=parts)],
+        )
+        return SendTaskResponse(id=request_id, result=task)
         
     def _get_user_query(self, task_send_params: TaskSendParams) -> str:
         """Extract the user query from task parameters"""
         part = task_send_params.message.parts[0]
-        if not isinstance(part, TextPart):
+        if getattr(part, "type", None) != "text":
             raise ValueError("Only text parts are supported")
         return part.text
\ No newline at end of file
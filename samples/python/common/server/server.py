@@ -1,5 +1,5 @@
 from starlette.applications import Starlette
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 from sse_starlette.sse import EventSourceResponse
 from starlette.requests import Request
 from common.types import (
@@ -41,6 +41,12 @@ class A2AServer:
         self.endpoint = endpoint
         self.task_manager = task_manager
         self.agent_card = agent_card
+        # The agent card is static, so serialize it once instead of per request
+        self._agent_card_json = (
+            agent_card.model_dump_json(exclude_none=True).encode()
+            if agent_card is not None
+            else None
+        )
         self.app = Starlette()
         self.app.add_route(self.endpoint, self._process_request, methods=["POST"])
         self.app.add_route(
@@ -48,18 +54,34 @@ class A2AServer:
         )
 
     def start(self):
+        self._check_configured()
+
+        import uvicorn
+
+        uvicorn.run(self.app, host=self.host, port=self.port)
+
+    async def serve(self):
+        """Run the server on the current event loop instead of starting a new one."""
+        self._check_configured()
+
+        import uvicorn
+
+        config = uvicorn.Config(self.app, host=self.host, port=self.port)
+        await uvicorn.Server(config).serve()
+
+    def _check_configured(self):
         if self.agent_card is None:
             raise ValueError("agent_card is not defined")
 
         if self.task_manager is None:
             raise ValueError("request_handler is not defined")
 
-        import uvicorn
-
-        uvicorn.run(self.app, host=self.host, port=self.port)
-
-    def _get_agent_card(self, request: Request) -> JSONResponse:
-        return JSONResponse(self.agent_card.model_dump(exclude_none=True))
+    def _get_agent_card(self, request: Request) -> Response:
+        if self._agent_card_json is None:
+            self._agent_card_json = self.agent_card.model_dump_json(
+                exclude_none=True
+            ).encode()
+        return Response(self._agent_card_json, media_type="application/json")
 
     async def _process_request(self, request: Request):
         try: